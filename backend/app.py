@@ -124,8 +124,9 @@ async def startup_event():
         logger.error(f"❌ User Management service failed: {e}")
 
     try:
-        from services.storage import model_storage  # noqa: F401
+        from services.storage import model_storage
 
+        model_storage.start_periodic_cleanup()
         logger.info("✅ Storage service loaded")
     except Exception as e:
         logger.error(f"❌ Storage service failed: {e}")
@@ -147,6 +148,7 @@ async def shutdown_event():
     try:
         from services.storage import model_storage
 
+        model_storage.stop_periodic_cleanup()
         cleanup_count = model_storage.cleanup_old_models()
         logger.info(f"🧹 Cleaned up {cleanup_count} temporary model files")
     except Exception as e:
@@ -4,7 +4,7 @@ BadCAD execution service for running BadCAD code and generating STL files
 
 import os
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable
 from contextlib import contextmanager
 import tempfile
 
@@ -12,7 +12,7 @@ from core.config import settings, BADCAD_AVAILABLE
 from core.exceptions import BadCADExecutionError, DependencyError, StorageError
 from services.storage import model_storage
 from utils.stl_fallback import create_fallback_stl
-from utils.code_extraction import validate_badcad_code
+from utils.code_extraction import compile_badcad_code, validate_badcad_code
 
 logger = logging.getLogger(__name__)
 
@@ -20,15 +20,19 @@ logger = logging.getLogger(__name__)
 class BadCADExecutor:
     """Service for executing BadCAD code and generating STL files"""
 
-    def __init__(self, temp_dir: Optional[str] = None):
+    def __init__(
+        self, temp_dir: Optional[str] = None, exec_fn: Callable[..., Any] = exec
+    ):
         """
         Initialize the BadCAD executor.
 
         Args:
             temp_dir: Directory for temporary files (defaults to settings)
+            exec_fn: Callable used to run the code (defaults to builtin exec)
         """
         self.temp_dir = temp_dir or settings.temp_dir
         self.available = BADCAD_AVAILABLE
+        self._exec_fn = exec_fn
 
     def execute_and_export(
         self, badcad_code: str, model_id: str, validate: bool = True
@@ -131,8 +135,8 @@ class BadCADExecutor:
 
             logger.debug(f"Executing BadCAD code:\n{badcad_code[:200]}...")
 
-            # Execute the code
-            exec(badcad_code, exec_globals, exec_locals)
+            # Execute the code (compiled objects are cached per code string)
+            self._exec_fn(compile_badcad_code(badcad_code), exec_globals, exec_locals)
 
             # Get the model from execution context
             model = None
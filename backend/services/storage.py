@@ -3,15 +3,25 @@ Storage service for managing files and temporary models
 """
 
 import os
+import heapq
+import time
 import uuid
 import threading
+from collections import deque
 from pathlib import Path
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime, timedelta
 from contextlib import contextmanager
 
 from core.config import settings
 
+# Number of independently locked model buckets (power of two for masking)
+_SHARD_COUNT = 16
+
+# Temp file names are drawn from a pool refilled with one urandom read
+_NAME_POOL_SIZE = 1024
+_NAME_BYTES = 16
+
 
 class ModelStorage:
     """Manages temporary model storage with automatic cleanup"""
@@ -28,9 +38,30 @@ class ModelStorage:
         self.temp_dir.mkdir(parents=True, exist_ok=True)
         self.cleanup_after = timedelta(hours=cleanup_after_hours)
 
-        # In-memory storage of model paths
-        self._models: Dict[str, Dict[str, Any]] = {}
-        self._lock = threading.RLock()
+        # In-memory storage of model paths, sharded so concurrent requests
+        # for different models don't serialize on a single lock
+        self._shards: List[Dict[str, Dict[str, Any]]] = [
+            {} for _ in range(_SHARD_COUNT)
+        ]
+        self._locks = [threading.RLock() for _ in range(_SHARD_COUNT)]
+
+        # Per-shard min-heaps of (expiry, model_id); entries go stale when a
+        # model is accessed or deleted and are re-checked when they surface
+        self._expiry_heaps: List[List[Tuple[float, str]]] = [
+            [] for _ in range(_SHARD_COUNT)
+        ]
+
+        # Pre-generated random hex names for temporary files
+        self._name_pool: deque = deque()
+        self._name_lock = threading.Lock()
+
+        # Background cleanup thread, started explicitly by the app
+        self._cleanup_stop = threading.Event()
+        self._cleanup_thread: Optional[threading.Thread] = None
+
+    def _shard(self, model_id: str) -> int:
+        """Return the shard index that holds the given model"""
+        return hash(model_id) & (_SHARD_COUNT - 1)
 
     def store_model(self, model_id: str, file_path: str) -> None:
         """
@@ -40,12 +71,18 @@ class ModelStorage:
             model_id: Unique identifier for the model
             file_path: Path to the model file
         """
-        with self._lock:
-            self._models[model_id] = {
+        shard = self._shard(model_id)
+        now = time.time()
+        with self._locks[shard]:
+            self._shards[shard][model_id] = {
                 "path": file_path,
-                "created_at": datetime.now(),
-                "accessed_at": datetime.now(),
+                "created_at": now,
+                "accessed_at": now,
             }
+            heapq.heappush(
+                self._expiry_heaps[shard],
+                (now + self.cleanup_after.total_seconds(), model_id),
+            )
 
     def get_model_path(self, model_id: str) -> Optional[str]:
         """
@@ -57,11 +94,13 @@ class ModelStorage:
         Returns:
             Path to the model file if it exists, None otherwise
         """
-        with self._lock:
-            model_info = self._models.get(model_id)
+        shard = self._shard(model_id)
+        with self._locks[shard]:
+            models = self._shards[shard]
+            model_info = models.get(model_id)
             if model_info:
                 # Update access time
-                model_info["accessed_at"] = datetime.now()
+                model_info["accessed_at"] = time.time()
                 path = model_info["path"]
 
                 # Verify file still exists
@@ -69,7 +108,7 @@ class ModelStorage:
                     return path
                 else:
                     # File was deleted externally
-                    del self._models[model_id]
+                    del models[model_id]
 
             return None
 
@@ -83,8 +122,10 @@ class ModelStorage:
         Returns:
             True if model was deleted, False if not found
         """
-        with self._lock:
-            model_info = self._models.get(model_id)
+        shard = self._shard(model_id)
+        with self._locks[shard]:
+            models = self._shards[shard]
+            model_info = models.get(model_id)
             if model_info:
                 # Delete the file
                 try:
@@ -93,7 +134,7 @@ class ModelStorage:
                     pass  # File may already be deleted
 
                 # Remove from storage
-                del self._models[model_id]
+                del models[model_id]
                 return True
 
             return False
@@ -108,25 +149,76 @@ class ModelStorage:
         Returns:
             Number of models cleaned up
         """
+        if force:
+            return self._cleanup_all_models()
+
         cleanup_count = 0
-        current_time = datetime.now()
+        ttl = self.cleanup_after.total_seconds()
+        now = time.time()
+
+        for lock, models, heap in zip(self._locks, self._shards, self._expiry_heaps):
+            with lock:
+                # Only pop entries that are due; the rest of the heap is untouched
+                while heap and heap[0][0] < now:
+                    _, model_id = heapq.heappop(heap)
+                    model_info = models.get(model_id)
+                    if model_info is None:
+                        continue  # Already deleted
+
+                    expires_at = model_info["accessed_at"] + ttl
+                    if expires_at < now:
+                        if self.delete_model(model_id):
+                            cleanup_count += 1
+                    else:
+                        # Accessed since it was queued; requeue at its new expiry
+                        heapq.heappush(heap, (expires_at, model_id))
 
-        with self._lock:
-            models_to_delete = []
+        return cleanup_count
 
-            for model_id, model_info in self._models.items():
-                if (
-                    force
-                    or (current_time - model_info["accessed_at"]) > self.cleanup_after
-                ):
-                    models_to_delete.append(model_id)
+    def _cleanup_all_models(self) -> int:
+        """Delete every stored model regardless of age"""
+        cleanup_count = 0
 
-            for model_id in models_to_delete:
-                if self.delete_model(model_id):
-                    cleanup_count += 1
+        for lock, models, heap in zip(self._locks, self._shards, self._expiry_heaps):
+            with lock:
+                for model_id in list(models):
+                    if self.delete_model(model_id):
+                        cleanup_count += 1
+                heap.clear()
 
         return cleanup_count
 
+    def start_periodic_cleanup(self, interval_seconds: float = 3600) -> None:
+        """
+        Run cleanup_old_models on a background daemon thread.
+
+        Args:
+            interval_seconds: Seconds between cleanup passes
+        """
+        if self._cleanup_thread and self._cleanup_thread.is_alive():
+            return
+
+        self._cleanup_stop.clear()
+        self._cleanup_thread = threading.Thread(
+            target=self._periodic_cleanup,
+            args=(interval_seconds,),
+            name="model-storage-cleanup",
+            daemon=True,
+        )
+        self._cleanup_thread.start()
+
+    def stop_periodic_cleanup(self) -> None:
+        """Stop the background cleanup thread if it is running"""
+        self._cleanup_stop.set()
+        if self._cleanup_thread:
+            self._cleanup_thread.join()
+            self._cleanup_thread = None
+
+    def _periodic_cleanup(self, interval_seconds: float) -> None:
+        """Cleanup loop; wakes every interval until stopped"""
+        while not self._cleanup_stop.wait(interval_seconds):
+            self.cleanup_old_models()
+
     def get_temp_file_path(self, prefix: str = "", suffix: str = ".stl") -> str:
         """
         Get a path for a new temporary file.
@@ -138,9 +230,24 @@ class ModelStorage:
         Returns:
             Path to the temporary file
         """
-        filename = f"{prefix}{uuid.uuid4()}{suffix}"
+        filename = f"{prefix}{self._next_name()}{suffix}"
         return str(self.temp_dir / filename)
 
+    def _next_name(self) -> str:
+        """Pop a unique random hex name, refilling the pool when it runs dry"""
+        while True:
+            try:
+                return self._name_pool.popleft()
+            except IndexError:
+                with self._name_lock:
+                    # Another thread may have refilled while we waited
+                    if not self._name_pool:
+                        chunk = os.urandom(_NAME_BYTES * _NAME_POOL_SIZE).hex()
+                        step = _NAME_BYTES * 2
+                        self._name_pool.extend(
+                            chunk[i : i + step] for i in range(0, len(chunk), step)
+                        )
+
     def list_models(self) -> Dict[str, Dict[str, Any]]:
         """
         List all stored models with their metadata.
@@ -148,15 +255,20 @@ class ModelStorage:
         Returns:
             Dictionary of model_id -> model info
         """
-        with self._lock:
-            return {
-                model_id: {
-                    "path": info["path"],
-                    "created_at": info["created_at"].isoformat(),
-                    "accessed_at": info["accessed_at"].isoformat(),
-                }
-                for model_id, info in self._models.items()
-            }
+        listing = {}
+        for lock, models in zip(self._locks, self._shards):
+            with lock:
+                for model_id, info in models.items():
+                    listing[model_id] = {
+                        "path": info["path"],
+                        "created_at": datetime.fromtimestamp(
+                            info["created_at"]
+                        ).isoformat(),
+                        "accessed_at": datetime.fromtimestamp(
+                            info["accessed_at"]
+                        ).isoformat(),
+                    }
+        return listing
 
     @contextmanager
     def temporary_model(self, model_id: Optional[str] = None):
@@ -89,10 +89,9 @@ class ModernUserManager:
         model_count = user_info.get("model_count", 0)
         if model_count >= self.max_models_per_user:
             raise UserLimitExceededError(
-                f"Model generation limit ({self.max_models_per_user}) reached",
                 user_id=user_id,
-                limit=self.max_models_per_user,
-                current=model_count,
+                current_count=model_count,
+                max_count=self.max_models_per_user,
             )
 
         return True
@@ -3,29 +3,123 @@ Pytest configuration and fixtures
 """
 
 import os
-import sys
-from pathlib import Path
+from collections import namedtuple
+from contextlib import ExitStack, asynccontextmanager
+from unittest.mock import patch
 
 import pytest
-
-# Add backend directory to Python path
-backend_dir = Path(__file__).parent.parent
-sys.path.insert(0, str(backend_dir))
+from fastapi.testclient import TestClient
+from httpx import ASGITransport, AsyncClient
 
 # Set test environment variables
 os.environ["GEMINI_API_KEY"] = "test_api_key"
 os.environ["TESTING"] = "true"
 
+# Canned AI output and export path for tests that stub out generation
+STUB_CODE = "from badcad import *\nmodel = cube(10,10,10)"
+STUB_STL = "/tmp/safe.stl"
+
+# Services the generation routes call, patched together by generation_patches
+GenerationStack = namedtuple(
+    "GenerationStack", ["ai_generator", "badcad_executor", "model_storage"]
+)
+
+
+@pytest.fixture(scope="session")
+def app_instance():
+    """Import the FastAPI app on first use rather than at collection"""
+    from app import app
+
+    return app
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _noop_lifespan(app_instance):
+    """Skip the app's startup/shutdown handlers; services are mocked in tests
+
+    Yields the real lifespan so fixtures can opt back in to it.
+    """
+    real_lifespan = app_instance.router.lifespan_context
+
+    @asynccontextmanager
+    async def noop(app):
+        yield
+
+    with patch.object(app_instance.router, "lifespan_context", noop):
+        yield real_lifespan
+
+
+@pytest.fixture(scope="session")
+def session_client(app_instance):
+    """Create one test client, and one portal, for the whole run"""
+    with TestClient(app_instance) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def client(session_client):
+    """Hand out the session client without cookies left by earlier tests"""
+    session_client.cookies.clear()
+    return session_client
+
+
+@pytest.fixture
+def fresh_client(app_instance, _noop_lifespan):
+    """Create an isolated test client that runs the app's real startup/shutdown"""
+    with patch.object(app_instance.router, "lifespan_context", _noop_lifespan):
+        with TestClient(app_instance) as test_client:
+            yield test_client
+
+
+@pytest.fixture
+async def async_client(app_instance):
+    """Create an async client that drives the ASGI app in-process"""
+    transport = ASGITransport(app=app_instance)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        yield ac
+
+
+@pytest.fixture(scope="class")
+def generation_patches():
+    """Patch the generation route's services once per test class"""
+    with ExitStack() as stack:
+        yield GenerationStack(
+            *(
+                stack.enter_context(patch(f"api.routes.generation.{name}"))
+                for name in GenerationStack._fields
+            )
+        )
+
+
+@pytest.fixture
+def generation_mocks(generation_patches):
+    """Hand out the class's generation mocks with their configuration cleared"""
+    for mock in generation_patches:
+        mock.reset_mock(return_value=True, side_effect=True)
+    return generation_patches
+
+
+@pytest.fixture
+def stub_code():
+    """BadCAD code the stubbed AI generator returns"""
+    return STUB_CODE
+
+
+@pytest.fixture
+def stub_stl():
+    """STL path the stubbed executor returns"""
+    return STUB_STL
+
 
 @pytest.fixture(autouse=True)
-def cleanup_test_files():
-    """Cleanup any test files created during tests"""
-    yield
+def _model_storage_state():
+    """Roll back the global model registry after each test"""
+    from services.storage import model_storage
 
-    # Remove any test JSON files
-    test_json = backend_dir / "collected_user_emails.json"
-    if test_json.exists():
-        test_json.unlink()
+    with ExitStack() as stack:
+        for shard in model_storage._shards:
+            stack.enter_context(patch.dict(shard, clear=True))
+        yield
 
 
 @pytest.fixture
@@ -36,6 +130,48 @@ def mock_env_vars(monkeypatch):
     yield
 
 
+@pytest.fixture
+def admin_summary():
+    """Patch the admin routes' user manager to return a fixed user summary"""
+    summary = {
+        "total_users": 2,
+        "total_prompts": 2,
+        "total_models_generated": 4,
+        "users": [
+            {
+                "user_id": "user1",
+                "email": "user1@example.com",
+                "name": "User One",
+                "model_count": 3,
+                "total_prompts": 2,
+                "created_at": "2024-01-01T10:00:00",
+                "last_activity": "2024-01-01T11:00:00",
+                "recent_prompts": [],
+            },
+            {
+                "user_id": "user2",
+                "email": "user2@example.com",
+                "name": "User Two",
+                "model_count": 1,
+                "total_prompts": 0,
+                "created_at": "2024-01-01T10:00:00",
+                "last_activity": "2024-01-01T11:00:00",
+                "recent_prompts": [],
+            },
+        ],
+    }
+
+    with patch("api.routes.admin.user_manager") as mock_um:
+        mock_um.get_all_users_summary.return_value = summary
+        yield summary
+
+
+@pytest.fixture
+def tmp_stl(tmp_path):
+    """Path for an STL file in the test's own tmp_path (not yet created)"""
+    return tmp_path / "f.stl"
+
+
 @pytest.fixture
 def temp_stl_file(tmp_path):
     """Create a temporary STL file for testing"""
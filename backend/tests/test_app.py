@@ -5,22 +5,16 @@ Tests API endpoints, helper functions, and service integrations
 for the modular FastAPI application.
 """
 
-import os
-import tempfile
+import struct
 from unittest.mock import AsyncMock, patch
 
 import pytest
-from fastapi.testclient import TestClient
-
-from app import app
-
-client = TestClient(app)
 
 
 class TestAPIEndpoints:
     """Test all API endpoints"""
 
-    def test_health_check(self):
+    def test_health_check(self, client):
         """Test health check endpoint"""
         response = client.get("/health")
         assert response.status_code == 200
@@ -29,7 +23,7 @@ class TestAPIEndpoints:
         assert data["version"] == "2.0.0"
         assert "services" in data
 
-    def test_root_endpoint(self):
+    def test_root_endpoint(self, client):
         """Test root endpoint"""
         response = client.get("/")
         assert response.status_code == 200
@@ -38,7 +32,7 @@ class TestAPIEndpoints:
         assert "docs" in data
         assert "endpoints" in data
 
-    def test_generate_model_success(self):
+    def test_generate_model_success(self, client):
         """Test successful model generation from prompt"""
         with (
             patch("api.routes.generation.ai_generator") as mock_ai,
@@ -61,7 +55,7 @@ class TestAPIEndpoints:
             assert "badcad_code" in data
             assert "cube" in data["badcad_code"]
 
-    def test_generate_model_with_user_limit(self):
+    def test_generate_model_with_user_limit(self, client):
         """Test model generation respects user limits"""
         with patch("api.routes.generation.user_manager") as mock_um:
             from core.exceptions import UserLimitExceededError
@@ -78,7 +72,7 @@ class TestAPIEndpoints:
             assert response.status_code == 403
             assert "limit reached" in response.json()["detail"].lower()
 
-    def test_generate_model_fallback_on_ai_failure(self):
+    def test_generate_model_fallback_on_ai_failure(self, client):
         """Test fallback generation when AI fails"""
         with (
             patch("api.routes.generation.ai_generator") as mock_ai,
@@ -102,7 +96,7 @@ class TestAPIEndpoints:
             assert data["success"] is True
             assert "fallback" in data["message"].lower()
 
-    def test_execute_badcad_code_success(self):
+    def test_execute_badcad_code_success(self, client):
         """Test direct BadCAD code execution"""
         with (
             patch("api.routes.generation.badcad_executor") as mock_exec,
@@ -120,7 +114,7 @@ class TestAPIEndpoints:
             assert data["success"] is True
             assert "model_id" in data
 
-    def test_execute_empty_code(self):
+    def test_execute_empty_code(self, client):
         """Test execute endpoint with empty/whitespace code"""
         response = client.post(
             "/api/execute",
@@ -130,7 +124,7 @@ class TestAPIEndpoints:
         assert response.status_code == 400
         assert "No code provided" in response.json()["detail"]
 
-    def test_user_info_create_new_user(self):
+    def test_user_info_create_new_user(self, client):
         """Test creating a new user"""
         with patch("api.routes.user.analytics_client") as mock_analytics:
             mock_analytics.create_session = AsyncMock(
@@ -157,7 +151,7 @@ class TestAPIEndpoints:
             assert data["model_count"] == 0
             assert data["max_models"] == 10
 
-    def test_user_info_update_existing_user(self):
+    def test_user_info_update_existing_user(self, client):
         """Test updating existing user info"""
         with patch("api.routes.user.analytics_client") as mock_analytics:
             mock_analytics.create_session = AsyncMock(
@@ -181,35 +175,30 @@ class TestAPIEndpoints:
             data = response.json()
             assert data["model_count"] == 5
 
-    def test_download_model_success(self):
+    def test_download_model_success(self, client, tmp_path):
         """Test downloading a generated model"""
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".stl", delete=False) as f:
-            f.write("solid test\nendsolid test")
-            stl_path = f.name
+        stl = tmp_path / "m.stl"
+        stl.write_text("solid test\nendsolid test")
 
         # Use UUID-length model_id (download route checks len >= 10)
         model_id = "a" * 36
 
-        try:
-            with (
-                patch("api.routes.download.model_storage") as mock_storage,
-                patch("api.routes.download.user_manager") as mock_um,
-            ):
-                mock_storage.get_model_path.return_value = stl_path
-                mock_um.track_model_download = AsyncMock()
-
-                response = client.get(f"/api/download/{model_id}")
-
-                assert response.status_code == 200
-                assert response.headers["content-type"] == "application/octet-stream"
-                assert f"model_{model_id}.stl" in response.headers.get(
-                    "content-disposition", ""
-                )
-        finally:
-            if os.path.exists(stl_path):
-                os.unlink(stl_path)
-
-    def test_download_nonexistent_model(self):
+        with (
+            patch("api.routes.download.model_storage") as mock_storage,
+            patch("api.routes.download.user_manager") as mock_um,
+        ):
+            mock_storage.get_model_path.return_value = str(stl)
+            mock_um.track_model_download = AsyncMock()
+
+            response = client.get(f"/api/download/{model_id}")
+
+            assert response.status_code == 200
+            assert response.headers["content-type"] == "application/octet-stream"
+            assert f"model_{model_id}.stl" in response.headers.get(
+                "content-disposition", ""
+            )
+
+    def test_download_nonexistent_model(self, client):
         """Test downloading non-existent model"""
         model_id = "a" * 36
 
@@ -221,45 +210,13 @@ class TestAPIEndpoints:
             assert response.status_code == 404
             assert "Model not found" in response.json()["detail"]
 
-    def test_admin_collected_emails_endpoint(self):
+    def test_admin_collected_emails_endpoint(self, client, admin_summary):
         """Test admin endpoint for viewing collected data"""
-        with patch("api.routes.admin.user_manager") as mock_um:
-            mock_um.get_all_users_summary.return_value = {
-                "total_users": 2,
-                "total_prompts": 2,
-                "total_models_generated": 4,
-                "users": [
-                    {
-                        "user_id": "user1",
-                        "email": "user1@example.com",
-                        "name": "User One",
-                        "model_count": 3,
-                        "total_prompts": 2,
-                        "created_at": "2024-01-01T10:00:00",
-                        "last_activity": "2024-01-01T11:00:00",
-                        "recent_prompts": [],
-                    },
-                    {
-                        "user_id": "user2",
-                        "email": "user2@example.com",
-                        "name": "User Two",
-                        "model_count": 1,
-                        "total_prompts": 0,
-                        "created_at": "2024-01-01T10:00:00",
-                        "last_activity": "2024-01-01T11:00:00",
-                        "recent_prompts": [],
-                    },
-                ],
-            }
-
-            response = client.get("/api/admin/collected-emails")
+        response = client.get("/api/admin/collected-emails")
 
-            assert response.status_code == 200
-            data = response.json()
-            assert data["total_users"] == 2
-            assert data["total_prompts"] == 2
-            assert data["total_models_generated"] == 4
-            assert len(data["users"]) == 2
+        # The route returns the user manager's summary unchanged
+        assert response.status_code == 200
+        assert response.json() == admin_summary
 
 
 class TestHelperFunctions:
@@ -323,34 +280,26 @@ This creates a sphere."""
         assert "from badcad import *" in code
         assert "model = sphere(r=5)" in code
 
-    def test_create_fallback_stl(self):
+    def test_create_fallback_stl(self, tmp_path):
         """Test fallback STL creation"""
         from utils.stl_fallback import create_fallback_stl
 
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".stl", delete=False) as f:
-            test_path = f.name
-
-        try:
-            create_fallback_stl(test_path)
+        path = tmp_path / "out.stl"
+        create_fallback_stl(str(path))
 
-            assert os.path.exists(test_path)
-            assert os.path.getsize(test_path) > 0
+        assert path.stat().st_size > 0
 
-            with open(test_path, "r") as f:
-                content = f.read()
-                assert content.startswith("solid cube")
-                assert content.endswith("endsolid cube")
-                assert "facet normal" in content
-                assert "vertex" in content
-        finally:
-            if os.path.exists(test_path):
-                os.unlink(test_path)
+        # Binary STL: 80-byte header, triangle count, 50 bytes per facet
+        content = path.read_bytes()
+        (triangle_count,) = struct.unpack_from("<I", content, 80)
+        assert triangle_count == 12
+        assert len(content) == 84 + 50 * triangle_count
 
 
 class TestGeminiIntegration:
     """Test Gemini AI integration through the API"""
 
-    def test_generate_with_ai_success(self):
+    def test_generate_with_ai_success(self, client):
         """Test successful AI code generation through the API"""
         with (
             patch("api.routes.generation.ai_generator") as mock_ai,
@@ -371,7 +320,7 @@ class TestGeminiIntegration:
             assert "from badcad import *" in data["badcad_code"]
             assert "model =" in data["badcad_code"]
 
-    def test_generate_ai_quota_exhausted(self):
+    def test_generate_ai_quota_exhausted(self, client):
         """Test handling of AI quota exhaustion"""
         with (
             patch("api.routes.generation.ai_generator") as mock_ai,
@@ -396,7 +345,7 @@ class TestGeminiIntegration:
             assert "fallback" in data["message"].lower()
             assert "from badcad import *" in data["badcad_code"]
 
-    def test_generate_ai_permission_denied(self):
+    def test_generate_ai_permission_denied(self, client):
         """Test handling of AI permission errors"""
         with (
             patch("api.routes.generation.ai_generator") as mock_ai,
@@ -424,7 +373,7 @@ class TestGeminiIntegration:
 class TestBadCADExecution:
     """Test BadCAD code execution through the API"""
 
-    def test_execute_success(self):
+    def test_execute_success(self, client):
         """Test successful BadCAD execution"""
         with (
             patch("api.routes.generation.badcad_executor") as mock_exec,
@@ -442,7 +391,7 @@ class TestBadCADExecution:
             assert data["success"] is True
             mock_exec.execute_and_export.assert_called_once()
 
-    def test_execute_failure(self):
+    def test_execute_failure(self, client):
         """Test BadCAD execution failure"""
         with patch("api.routes.generation.badcad_executor") as mock_exec:
             from core.exceptions import BadCADExecutionError
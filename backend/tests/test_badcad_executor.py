@@ -2,7 +2,8 @@
 Tests for BadCAD executor service
 """
 
-import tempfile
+import os
+from pathlib import Path
 from unittest.mock import MagicMock, mock_open, patch
 
 import pytest
@@ -11,44 +12,92 @@ from core.exceptions import BadCADExecutionError, StorageError
 from services.badcad_executor import BadCADExecutor, badcad_executor
 
 
-class TestBadCADExecutor:
-    """Test the BadCADExecutor class"""
+@pytest.fixture(scope="module")
+def mock_model_prototype():
+    """Build the BadCAD model double once per module"""
+    return MagicMock()
 
-    def test_init_with_defaults(self):
-        """Test initialization with default settings"""
-        executor = BadCADExecutor()
-        assert executor.temp_dir is not None
-        assert isinstance(executor.available, bool)
 
-    def test_init_with_custom_temp_dir(self):
-        """Test initialization with custom temp directory"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            executor = BadCADExecutor(temp_dir=temp_dir)
-            assert executor.temp_dir == temp_dir
+@pytest.fixture
+def mock_model(mock_model_prototype):
+    """Hand out the shared model double, reset to a string-returning stl()"""
+    mock_model_prototype.reset_mock(return_value=True, side_effect=True)
+    mock_model_prototype.stl.return_value = "STL content"
+    return mock_model_prototype
 
-    def test_execute_empty_code_raises_error(self):
-        """Test that empty code raises error"""
-        executor = BadCADExecutor()
 
+@pytest.fixture(scope="class")
+def shared_open_mock():
+    """Build the builtins.open double once per test class"""
+    return mock_open()
+
+
+@pytest.fixture
+def open_mock(shared_open_mock):
+    """Patch builtins.open with the class double so writes are swallowed"""
+    shared_open_mock.reset_mock()
+    with patch("builtins.open", shared_open_mock):
+        yield shared_open_mock
+
+
+@pytest.fixture
+def stl_path(tmp_path):
+    """Path for an exported STL file inside the test's temp dir"""
+    return str(tmp_path / "test.stl")
+
+
+@pytest.fixture(scope="class")
+def shared_executor(tmp_path_factory):
+    """Build one executor per test class over a pytest-managed temp dir"""
+    return BadCADExecutor(temp_dir=str(tmp_path_factory.mktemp("bce")))
+
+
+@pytest.fixture
+def executor(request, shared_executor):
+    """Hand out the class executor, available per its marker, restored afterwards"""
+    available, exec_fn = shared_executor.available, shared_executor._exec_fn
+    marker = request.node.get_closest_marker("badcad_available")
+    if marker is not None:
+        shared_executor.available = marker.args[0]
+    yield shared_executor
+    shared_executor.available, shared_executor._exec_fn = available, exec_fn
+
+
+class TestBadCADExecutor:
+    """Test the BadCADExecutor class"""
+
+    @pytest.mark.parametrize(
+        "factory",
+        [
+            lambda tmp_path: BadCADExecutor(),
+            lambda tmp_path: BadCADExecutor(temp_dir=str(tmp_path)),
+            lambda tmp_path: badcad_executor,
+        ],
+        ids=["defaults", "custom_temp_dir", "global_instance"],
+    )
+    def test_init(self, factory, tmp_path):
+        """Test that executors are initialized with a temp dir and availability flag"""
+        executor = factory(tmp_path)
+        assert isinstance(executor, BadCADExecutor)
+        assert executor.temp_dir and isinstance(executor.available, bool)
+
+    def test_execute_empty_code_raises_error(self, executor):
+        """Test that empty code raises error"""
         with pytest.raises(BadCADExecutionError) as exc_info:
             executor.execute_and_export("", "test_model")
 
         assert "empty" in exc_info.value.message.lower()
 
-    def test_execute_empty_model_id_raises_error(self):
+    def test_execute_empty_model_id_raises_error(self, executor):
         """Test that empty model ID raises error"""
-        executor = BadCADExecutor()
-
         with pytest.raises(BadCADExecutionError) as exc_info:
             executor.execute_and_export("valid code", "")
 
         assert "model id" in exc_info.value.message.lower()
 
-    @patch("services.badcad_executor.BADCAD_AVAILABLE", False)
-    def test_execute_with_unavailable_badcad(self):
+    @pytest.mark.badcad_available(False)
+    def test_execute_with_unavailable_badcad(self, executor):
         """Test execution when BadCAD is unavailable"""
-        executor = BadCADExecutor()
-        executor.available = False
 
         with patch("services.badcad_executor.create_fallback_stl") as mock_fallback:
             stl_path = executor.execute_and_export(
@@ -58,45 +107,30 @@ class TestBadCADExecutor:
             mock_fallback.assert_called_once()
             assert stl_path is not None
 
-    @patch("services.badcad_executor.BADCAD_AVAILABLE", True)
-    def test_execute_with_valid_code(self):
+    @pytest.mark.badcad_available(True)
+    def test_execute_with_valid_code(self, executor, mock_model, fs):
         """Test execution with valid BadCAD code"""
-        # Mock BadCAD module and model object
-        mock_model = MagicMock()
-        mock_model.stl.return_value = "STL content here"
 
-        # Mock the execution environment
-        with patch("builtins.exec") as mock_exec:
+        # Stand in for exec by placing the model in the execution context
+        def fake_exec(code, globals_dict, locals_dict=None):
+            if locals_dict is not None:
+                locals_dict["model"] = mock_model
+            else:
+                globals_dict["model"] = mock_model
 
-            def side_effect(code, globals_dict, locals_dict=None):
-                if locals_dict is not None:
-                    locals_dict["model"] = mock_model
-                else:
-                    globals_dict["model"] = mock_model
+        executor._exec_fn = fake_exec
 
-            mock_exec.side_effect = side_effect
+        stl_path = executor.execute_and_export(
+            "from badcad import *\nmodel = cube(10,10,10)",
+            "test_model",
+        )
 
-            with patch("builtins.open", mock_open()) as mock_file:
-                with patch("os.path.exists", return_value=True):
-                    with patch("os.path.getsize", return_value=100):
-                        with patch("os.makedirs"):
-                            executor = BadCADExecutor()
-                            executor.available = True
+        assert os.path.getsize(stl_path) == len("STL content")
+        mock_model.stl.assert_called_once()
 
-                            stl_path = executor.execute_and_export(
-                                "from badcad import *\nmodel = cube(10,10,10)",
-                                "test_model",
-                            )
-
-                            assert stl_path is not None
-                            mock_model.stl.assert_called_once()
-                            mock_file.assert_called()
-
-    @patch("services.badcad_executor.BADCAD_AVAILABLE", True)
-    def test_execute_with_invalid_code_validation(self):
+    @pytest.mark.badcad_available(True)
+    def test_execute_with_invalid_code_validation(self, executor):
         """Test execution with code that fails validation"""
-        executor = BadCADExecutor()
-        executor.available = True
 
         with pytest.raises(BadCADExecutionError) as exc_info:
             executor.execute_and_export(
@@ -105,234 +139,163 @@ class TestBadCADExecutor:
 
         assert "validation failed" in exc_info.value.message.lower()
 
-    @patch("services.badcad_executor.BADCAD_AVAILABLE", True)
-    def test_execute_without_validation(self):
+    @pytest.mark.badcad_available(True)
+    def test_execute_without_validation(self, executor, mock_model, fs):
         """Test execution without code validation"""
-        mock_model = MagicMock()
-        mock_model.stl.return_value = "STL content"
-
-        with patch("builtins.exec") as mock_exec:
-
-            def side_effect(code, globals_dict, locals_dict=None):
-                if locals_dict is not None:
-                    locals_dict["model"] = mock_model
-                else:
-                    globals_dict["model"] = mock_model
 
-            mock_exec.side_effect = side_effect
+        def fake_exec(code, globals_dict, locals_dict=None):
+            if locals_dict is not None:
+                locals_dict["model"] = mock_model
+            else:
+                globals_dict["model"] = mock_model
 
-            with patch("builtins.open", mock_open()):
-                with patch("os.path.exists", return_value=True):
-                    with patch("os.path.getsize", return_value=100):
-                        with patch("os.makedirs"):
-                            executor = BadCADExecutor()
-                            executor.available = True
+        executor._exec_fn = fake_exec
 
-                            # This would fail validation but we're skipping it
-                            stl_path = executor.execute_and_export(
-                                "invalid = syntax", "test_model", validate=False
-                            )
+        # This would fail validation but we're skipping it
+        stl_path = executor.execute_and_export(
+            "invalid = syntax", "test_model", validate=False
+        )
 
-                            assert stl_path is not None
+        assert stl_path is not None
 
-    @patch("services.badcad_executor.BADCAD_AVAILABLE", True)
-    def test_execute_with_no_model_variable(self):
+    @pytest.mark.badcad_available(True)
+    def test_execute_with_no_model_variable(self, executor):
         """Test execution when no model variable is found"""
-        with patch("builtins.exec") as mock_exec:
-            # Exec doesn't set any model variable
-            mock_exec.return_value = None
+        # Exec doesn't set any model variable
+        executor._exec_fn = lambda code, globals_dict, locals_dict=None: None
 
-            with patch("services.badcad_executor.create_fallback_stl") as mock_fallback:
-                executor = BadCADExecutor()
-                executor.available = True
-
-                stl_path = executor.execute_and_export(
-                    "from badcad import *\nother_var = cube(10,10,10)",
-                    "test_model",
-                    validate=False,  # Skip validation for this test
-                )
+        with patch("services.badcad_executor.create_fallback_stl") as mock_fallback:
+            stl_path = executor.execute_and_export(
+                "from badcad import *\nother_var = cube(10,10,10)",
+                "test_model",
+                validate=False,  # Skip validation for this test
+            )
 
-                # Should fall back due to missing model variable
-                mock_fallback.assert_called_once()
-                assert stl_path is not None
+            # Should fall back due to missing model variable
+            mock_fallback.assert_called_once()
+            assert stl_path is not None
 
-    @patch("services.badcad_executor.BADCAD_AVAILABLE", True)
-    def test_execute_with_alternative_model_variable(self):
+    @pytest.mark.badcad_available(True)
+    def test_execute_with_alternative_model_variable(self, executor, mock_model, fs):
         """Test execution when model is in different variable"""
-        mock_model = MagicMock()
-        mock_model.stl.return_value = "STL content"
 
-        with patch("builtins.exec") as mock_exec:
+        def fake_exec(code, globals_dict, locals_dict=None):
+            # Put model in different variable name
+            target_dict = locals_dict if locals_dict is not None else globals_dict
+            target_dict["my_shape"] = mock_model
 
-            def side_effect(code, globals_dict, locals_dict=None):
-                # Put model in different variable name
-                target_dict = locals_dict if locals_dict is not None else globals_dict
-                target_dict["my_shape"] = mock_model
+        executor._exec_fn = fake_exec
 
-            mock_exec.side_effect = side_effect
+        stl_path = executor.execute_and_export(
+            "from badcad import *\nmy_shape = cube(10,10,10)",
+            "test_model",
+            validate=False,  # Skip validation for this test
+        )
 
-            with patch("builtins.open", mock_open()):
-                with patch("os.path.exists", return_value=True):
-                    with patch("os.path.getsize", return_value=100):
-                        with patch("os.makedirs"):
-                            executor = BadCADExecutor()
-                            executor.available = True
+        assert stl_path is not None
+        mock_model.stl.assert_called_once()
 
-                            stl_path = executor.execute_and_export(
-                                "from badcad import *\nmy_shape = cube(10,10,10)",
-                                "test_model",
-                                validate=False,  # Skip validation for this test
-                            )
+    @pytest.mark.badcad_available(True)
+    def test_execute_badcad_code_with_execution_error(self, executor):
+        """Test handling of code execution errors"""
 
-                            assert stl_path is not None
-                            mock_model.stl.assert_called_once()
+        def fake_exec(code, globals_dict, locals_dict=None):
+            raise SyntaxError("Invalid syntax")
 
-    def test_execute_badcad_code_with_execution_error(self):
-        """Test handling of code execution errors"""
-        executor = BadCADExecutor()
-        executor.available = True
+        executor._exec_fn = fake_exec
 
-        with patch("builtins.exec", side_effect=SyntaxError("Invalid syntax")):
-            with pytest.raises(BadCADExecutionError) as exc_info:
-                executor._execute_badcad_code("invalid code")
+        with pytest.raises(BadCADExecutionError) as exc_info:
+            executor._execute_badcad_code("invalid code")
 
-            assert "execution failed" in exc_info.value.message.lower()
+        assert "execution failed" in exc_info.value.message.lower()
 
-    def test_export_to_stl_with_model_without_stl_method(self):
+    def test_export_to_stl_with_model_without_stl_method(self, executor, stl_path):
         """Test STL export with model that doesn't have stl method"""
-        executor = BadCADExecutor()
-
         mock_model = MagicMock()
         del mock_model.stl  # Remove stl method
 
         with pytest.raises(BadCADExecutionError) as exc_info:
-            executor._export_to_stl(mock_model, "/tmp/test.stl")
+            executor._export_to_stl(mock_model, stl_path)
 
         assert "does not have an 'stl' method" in exc_info.value.message
 
-    def test_export_to_stl_with_empty_stl_data(self):
-        """Test STL export when model returns empty STL data"""
-        executor = BadCADExecutor()
-
-        mock_model = MagicMock()
-        mock_model.stl.return_value = ""
-
-        with pytest.raises(BadCADExecutionError) as exc_info:
-            executor._export_to_stl(mock_model, "/tmp/test.stl")
-
-        assert "empty STL data" in exc_info.value.message
-
-    def test_export_to_stl_bytes_data(self):
-        """Test STL export with bytes data"""
-        executor = BadCADExecutor()
-
-        mock_model = MagicMock()
-        mock_model.stl.return_value = b"binary STL data"
+    @pytest.mark.parametrize(
+        "stl_return, mode",
+        [
+            pytest.param(b"binary STL data", "rb", id="bytes_data"),
+            pytest.param("text STL data", "r", id="string_data"),
+        ],
+    )
+    def test_export_to_stl(self, executor, mock_model, stl_path, stl_return, mode):
+        """Test STL export writes bytes and strings to the file unchanged"""
+        mock_model.stl.return_value = stl_return
 
-        with patch("builtins.open", mock_open()) as mock_file:
-            with patch("os.path.exists", return_value=True):
-                with patch("os.path.getsize", return_value=100):
-                    with patch("os.makedirs"):
-                        executor._export_to_stl(mock_model, "/tmp/test.stl")
-
-                        # Should open in binary mode for bytes
-                        mock_file.assert_called_with("/tmp/test.stl", "wb")
-
-    def test_export_to_stl_string_data(self):
-        """Test STL export with string data"""
-        executor = BadCADExecutor()
-
-        mock_model = MagicMock()
-        mock_model.stl.return_value = "text STL data"
-
-        with patch("builtins.open", mock_open()) as mock_file:
-            with patch("os.path.exists", return_value=True):
-                with patch("os.path.getsize", return_value=100):
-                    with patch("os.makedirs"):
-                        executor._export_to_stl(mock_model, "/tmp/test.stl")
-
-                        # Should open in text mode for strings
-                        mock_file.assert_called_with("/tmp/test.stl", "w")
-
-    def test_export_to_stl_file_not_created(self):
-        """Test STL export when file is not created"""
-        executor = BadCADExecutor()
-
-        mock_model = MagicMock()
-        mock_model.stl.return_value = "STL data"
+        executor._export_to_stl(mock_model, stl_path)
 
-        with patch("builtins.open", mock_open()):
-            with patch("os.path.exists", return_value=False):  # File not created
-                with patch("os.makedirs"):
-                    with pytest.raises(StorageError) as exc_info:
-                        executor._export_to_stl(mock_model, "/tmp/test.stl")
+        with open(stl_path, mode) as f:
+            assert f.read() == stl_return
 
-                    assert "was not created" in exc_info.value.message
-
-    def test_export_to_stl_empty_file(self):
-        """Test STL export when file is empty"""
-        executor = BadCADExecutor()
-
-        mock_model = MagicMock()
-        mock_model.stl.return_value = "STL data"
-
-        with patch("builtins.open", mock_open()):
-            with patch("os.path.exists", return_value=True):
-                with patch("os.path.getsize", return_value=0):  # Empty file
-                    with patch("os.makedirs"):
-                        with pytest.raises(StorageError) as exc_info:
-                            executor._export_to_stl(mock_model, "/tmp/test.stl")
-
-                        assert "is empty" in exc_info.value.message
+    def test_export_to_stl_with_empty_stl_data(self, executor, mock_model, stl_path):
+        """Test STL export rejects a model that produces no data"""
+        mock_model.stl.return_value = ""
 
-    def test_sandbox_execution_context_manager(self):
+        with pytest.raises(BadCADExecutionError, match="empty STL data"):
+            executor._export_to_stl(mock_model, stl_path)
+
+    @pytest.mark.parametrize(
+        "existing_contents, expected_msg",
+        [
+            pytest.param(None, "was not created", id="file_not_created"),
+            pytest.param("", "is empty", id="empty_file"),
+        ],
+    )
+    def test_export_to_stl_verification_failure(
+        self, executor, mock_model, open_mock, stl_path, existing_contents, expected_msg
+    ):
+        """Test STL export checks the written file when the write is lost"""
+        if existing_contents is not None:
+            Path(stl_path).write_text(existing_contents)
+
+        with pytest.raises(StorageError, match=expected_msg):
+            executor._export_to_stl(mock_model, stl_path)
+
+        open_mock.assert_called_once_with(stl_path, "w")
+
+    def test_sandbox_execution_context_manager(self, executor):
         """Test sandbox execution context manager"""
-        executor = BadCADExecutor()
-
         # Should work as a context manager
         with executor.sandbox_execution():
             pass  # Context manager should work without errors
 
-    @patch("services.badcad_executor.BADCAD_AVAILABLE", True)
-    def test_validate_execution_environment_with_badcad(self):
+    @pytest.mark.badcad_available(True)
+    def test_validate_execution_environment_with_badcad(self, executor):
         """Test environment validation when BadCAD is available"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            executor = BadCADExecutor(temp_dir=temp_dir)
-            executor.available = True
 
-            with patch("importlib.import_module") as mock_import:
-                mock_badcad = MagicMock()
-                mock_badcad.__version__ = "1.0.0"
-                mock_import.return_value = mock_badcad
+        with patch("importlib.import_module") as mock_import:
+            mock_badcad = MagicMock()
+            mock_badcad.__version__ = "1.0.0"
+            mock_import.return_value = mock_badcad
 
-                status = executor.validate_execution_environment()
+            status = executor.validate_execution_environment()
 
-                assert status["badcad_available"] is True
-                assert status["temp_dir_exists"] is True
-                assert status["temp_dir_writable"] is True
+            assert status["badcad_available"] is True
+            assert status["temp_dir_exists"] is True
+            assert status["temp_dir_writable"] is True
 
-    @patch("services.badcad_executor.BADCAD_AVAILABLE", False)
-    def test_validate_execution_environment_without_badcad(self):
+    @pytest.mark.badcad_available(False)
+    def test_validate_execution_environment_without_badcad(self, executor):
         """Test environment validation when BadCAD is not available"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            executor = BadCADExecutor(temp_dir=temp_dir)
-            executor.available = False
 
-            status = executor.validate_execution_environment()
+        status = executor.validate_execution_environment()
 
-            assert status["badcad_available"] is False
-            assert status["temp_dir_exists"] is True
-            assert status["temp_dir_writable"] is True
+        assert status["badcad_available"] is False
+        assert status["temp_dir_exists"] is True
+        assert status["temp_dir_writable"] is True
 
 
 class TestGlobalBadCADExecutor:
     """Test the global badcad_executor instance"""
 
-    def test_global_instance_exists(self):
-        """Test that global instance is properly initialized"""
-        assert badcad_executor is not None
-        assert isinstance(badcad_executor, BadCADExecutor)
-
     def test_global_instance_functional(self):
         """Test that global instance can execute code"""
         with patch.object(badcad_executor, "available", False):
@@ -348,36 +311,26 @@ class TestGlobalBadCADExecutor:
 class TestCodeExecution:
     """Test actual code execution scenarios"""
 
-    def test_execute_simple_cube_code(self):
+    @pytest.mark.badcad_available(True)
+    def test_execute_simple_cube_code(self, executor, mock_model, fs):
         """Test executing simple cube creation code"""
-        executor = BadCADExecutor()
-
-        # Mock a successful execution
-        mock_model = MagicMock()
-        mock_model.stl.return_value = "solid cube\n...\nendsolid cube"
-
-        with patch("builtins.exec") as mock_exec:
-
-            def side_effect(code, globals_dict, locals_dict=None):
-                target_dict = locals_dict if locals_dict is not None else globals_dict
-                target_dict["model"] = mock_model
+        exec_calls = []
 
-            mock_exec.side_effect = side_effect
+        def fake_exec(code, globals_dict, locals_dict=None):
+            exec_calls.append(code)
+            target_dict = locals_dict if locals_dict is not None else globals_dict
+            target_dict["model"] = mock_model
 
-            with patch("builtins.open", mock_open()):
-                with patch("os.path.exists", return_value=True):
-                    with patch("os.path.getsize", return_value=100):
-                        with patch("os.makedirs"):
-                            executor.available = True
+        executor._exec_fn = fake_exec
 
-                            code = """
+        code = """
 from badcad import *
 cube_obj = cube(10, 10, 10, center=True)
 model = cube_obj
 """
 
-                            stl_path = executor.execute_and_export(code, "cube_test")
+        stl_path = executor.execute_and_export(code, "cube_test")
 
-                            assert stl_path is not None
-                            mock_exec.assert_called_once()
-                            mock_model.stl.assert_called_once()
+        assert stl_path is not None
+        assert len(exec_calls) == 1
+        mock_model.stl.assert_called_once()
@@ -2,49 +2,30 @@
 Tests for code extraction utilities
 """
 
-from utils.code_extraction import clean_code, extract_badcad_code, validate_badcad_code
-
+import pytest
 
-class TestExtractBadCADCode:
-    """Test the extract_badcad_code function"""
+from utils import code_extraction
+from utils.code_extraction import clean_code, extract_badcad_code, validate_badcad_code
 
-    def test_extract_from_markdown_code_block(self):
-        """Test extraction from markdown code blocks"""
-        response = """Here's the code:
+MARKDOWN_BLOCK_PYTHON = """Here's the code:
 ```python
 from badcad import *
 model = cube(10, 10, 10)
 ```
 That's it!"""
 
-        result = extract_badcad_code(response)
-        assert result == "from badcad import *\nmodel = cube(10, 10, 10)"
-
-    def test_extract_from_plain_code_block(self):
-        """Test extraction from plain code blocks"""
-        response = """```
+MARKDOWN_BLOCK_PLAIN = """```
 from badcad import *
 model = sphere(r=5)
 ```"""
 
-        result = extract_badcad_code(response)
-        assert result == "from badcad import *\nmodel = sphere(r=5)"
-
-    def test_extract_inline_code(self):
-        """Test extraction when code is inline without blocks"""
-        response = """Let me create a cylinder for you:
+INLINE_CODE = """Let me create a cylinder for you:
 from badcad import *
 base = circle(r=10)
 model = base.extrude(20)
 That should work!"""
 
-        result = extract_badcad_code(response)
-        assert "from badcad import *" in result
-        assert "model = base.extrude(20)" in result
-
-    def test_extract_with_mixed_content(self):
-        """Test extraction with mixed explanatory text and code"""
-        response = """I'll create a simple box.
+INLINE_MIXED = """I'll create a simple box.
 from badcad import *
 # Create a square base
 square_base = square(20, 20, center=True)
@@ -52,76 +33,111 @@ square_base = square(20, 20, center=True)
 model = square_base.extrude(10)
 This creates a 20x20x10 box centered at origin."""
 
+NO_CODE = "I cannot generate BadCAD code for this request."
+
+VALID_CODE = """from badcad import *
+box = cube(10, 10, 10)
+model = box"""
+
+MISSING_IMPORT = "model = cube(10, 10, 10)"
+
+MISSING_MODEL = """from badcad import *
+box = cube(10, 10, 10)"""
+
+SYNTAX_ERROR = """from badcad import *
+model = cube(10, 10, 10"""  # Missing closing paren
+
+ALTERNATIVE_IMPORT = """import badcad
+model = badcad.cube(10, 10, 10)"""
+
+
+class TestExtractBadCADCode:
+    """Test the extract_badcad_code function"""
+
+    @pytest.mark.parametrize(
+        "response, expected_substrings, forbidden_substrings",
+        [
+            pytest.param(
+                MARKDOWN_BLOCK_PYTHON,
+                ["from badcad import *\nmodel = cube(10, 10, 10)"],
+                ["```", "Here's the code", "That's it"],
+                id="markdown_code_block",
+            ),
+            pytest.param(
+                MARKDOWN_BLOCK_PLAIN,
+                ["from badcad import *\nmodel = sphere(r=5)"],
+                ["```"],
+                id="plain_code_block",
+            ),
+            pytest.param(
+                INLINE_CODE,
+                ["from badcad import *", "model = base.extrude(20)"],
+                [],
+                id="inline_code",
+            ),
+            pytest.param(
+                INLINE_MIXED,
+                [
+                    "from badcad import *",
+                    "square_base = square(20, 20, center=True)",
+                    "model = square_base.extrude(10)",
+                ],
+                ["This creates a 20x20x10 box"],
+                id="mixed_content",
+            ),
+            pytest.param(NO_CODE, [NO_CODE], [], id="no_code"),
+        ],
+    )
+    def test_extract(self, response, expected_substrings, forbidden_substrings):
+        """Test extraction keeps the code and drops the surrounding text"""
         result = extract_badcad_code(response)
-        assert "from badcad import *" in result
-        assert "square_base = square(20, 20, center=True)" in result
-        assert "model = square_base.extrude(10)" in result
-        assert "This creates a 20x20x10 box" not in result
+
+        for expected in expected_substrings:
+            assert expected in result
+        for forbidden in forbidden_substrings:
+            assert forbidden not in result
 
     def test_extract_empty_response(self):
         """Test extraction from empty response"""
         assert extract_badcad_code("") == ""
         assert extract_badcad_code(None) == ""
 
-    def test_extract_no_code(self):
-        """Test extraction when response has no code"""
-        response = "I cannot generate BadCAD code for this request."
-        result = extract_badcad_code(response)
-        assert result == response.strip()
-
 
 class TestValidateBadCADCode:
     """Test the validate_badcad_code function"""
 
-    def test_valid_code(self):
-        """Test validation of valid BadCAD code"""
-        code = """from badcad import *
-box = cube(10, 10, 10)
-model = box"""
-
+    @pytest.mark.parametrize(
+        "code, expected_valid, err_substring",
+        [
+            pytest.param(VALID_CODE, True, None, id="valid_code"),
+            pytest.param("", False, "empty", id="empty_code"),
+            pytest.param(MISSING_IMPORT, False, "import", id="missing_import"),
+            pytest.param(MISSING_MODEL, False, "model", id="missing_model_variable"),
+            pytest.param(SYNTAX_ERROR, False, "Syntax error", id="syntax_error"),
+            pytest.param(ALTERNATIVE_IMPORT, True, None, id="alternative_import_style"),
+        ],
+    )
+    def test_validate(self, code, expected_valid, err_substring):
+        """Test validation result and error message for each kind of input"""
         is_valid, error = validate_badcad_code(code)
-        assert is_valid is True
-        assert error is None
-
-    def test_empty_code(self):
-        """Test validation of empty code"""
-        is_valid, error = validate_badcad_code("")
-        assert is_valid is False
-        assert "empty" in error.lower()
-
-    def test_missing_import(self):
-        """Test validation when import is missing"""
-        code = "model = cube(10, 10, 10)"
-        is_valid, error = validate_badcad_code(code)
-        assert is_valid is False
-        assert "import" in error.lower()
 
-    def test_missing_model_variable(self):
-        """Test validation when model variable is missing"""
-        code = """from badcad import *
-box = cube(10, 10, 10)"""
+        assert is_valid is expected_valid
+        if err_substring is None:
+            assert error is None
+        else:
+            assert err_substring in error
 
-        is_valid, error = validate_badcad_code(code)
-        assert is_valid is False
-        assert "model" in error.lower()
+    def test_oversized_code_bypasses_caches(self):
+        """Test that code above the cache threshold is validated but not cached"""
+        big_code = VALID_CODE + "\n#" + "x" * code_extraction._CACHE_MAX_CODE_LEN
+        validate_cache = code_extraction._validate_badcad_code_cached
+        compile_cache = code_extraction._compile_cached
+        before = (validate_cache.cache_info(), compile_cache.cache_info())
 
-    def test_syntax_error(self):
-        """Test validation with syntax error"""
-        code = """from badcad import *
-model = cube(10, 10, 10"""  # Missing closing paren
+        assert validate_badcad_code(big_code) == (True, None)
+        assert validate_badcad_code(big_code + "\nmodel = (")[0] is False
 
-        is_valid, error = validate_badcad_code(code)
-        assert is_valid is False
-        assert "Syntax error" in error
-
-    def test_alternative_import_style(self):
-        """Test validation with alternative import style"""
-        code = """import badcad
-model = badcad.cube(10, 10, 10)"""
-
-        is_valid, error = validate_badcad_code(code)
-        assert is_valid is True
-        assert error is None
+        assert (validate_cache.cache_info(), compile_cache.cache_info()) == before
 
 
 class TestCleanCode:
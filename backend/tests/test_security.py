@@ -2,94 +2,119 @@
 Security and edge case tests for the Text-to-CAD API
 """
 
+import asyncio
 from unittest.mock import AsyncMock, patch
 
 import pytest
-from fastapi.testclient import TestClient
 
-from app import app
+from api.routes import user as user_routes
 
-client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def mock_generation_stack(generation_mocks, stub_code, stub_stl):
+    """Reset the class's generation mocks to a successful cube generation"""
+    generation_mocks.ai_generator.generate_badcad_code.return_value = stub_code
+    generation_mocks.badcad_executor.execute_and_export.return_value = stub_stl
+    return generation_mocks
+
+
+@pytest.fixture(scope="class", autouse=True)
+def analytics_patch():
+    """Patch the user route's analytics client once per test class"""
+    with patch.object(user_routes, "analytics_client") as mock_analytics:
+        mock_analytics.create_session = AsyncMock(
+            return_value={
+                "user": {"model_count": 0},
+                "session_id": "test",
+                "csrf_token": "test",
+            }
+        )
+        yield mock_analytics
+
+
+@pytest.fixture(autouse=True)
+def mock_analytics(analytics_patch):
+    """Clear the class's analytics mock calls and side effects between tests"""
+    analytics_patch.reset_mock(side_effect=True)
+    return analytics_patch
 
 
 class TestSecurityConcerns:
     """Test security-related issues"""
 
-    def test_path_traversal_in_download(self):
-        """Test path traversal attempts in download endpoint"""
-        dangerous_ids = [
+    @pytest.mark.parametrize(
+        "dangerous_id",
+        [
             "../../../etc/passwd",
             "..\\..\\..\\windows\\system32\\config\\sam",
             "/etc/passwd",
             "C:\\Windows\\System32\\config\\SAM",
-        ]
-
-        for dangerous_id in dangerous_ids:
-            response = client.get(f"/api/download/{dangerous_id}")
-            # Should return 404, not expose system files
-            assert response.status_code == 404
+        ],
+    )
+    def test_path_traversal_in_download(self, client, dangerous_id):
+        """Test path traversal attempts in download endpoint"""
+        response = client.get(f"/api/download/{dangerous_id}")
+        # Should return 404, not expose system files
+        assert response.status_code == 404
 
-    def test_sql_injection_in_user_id(self):
+    def test_sql_injection_in_user_id(self, client):
         """Test SQL injection attempts in user_id field"""
-        with patch("api.routes.user.analytics_client") as mock_analytics:
-            mock_analytics.create_session = AsyncMock(
-                return_value={
-                    "user": {"model_count": 0},
-                    "session_id": "test",
-                    "csrf_token": "test",
-                }
-            )
+        response = client.post(
+            "/api/user/info",
+            json={
+                "user_id": "'; DROP TABLE users; --",
+                "email": "hacker@evil.com",
+                "name": "Bobby Tables",
+            },
+        )
 
-            response = client.post(
-                "/api/user/info",
-                json={
-                    "user_id": "'; DROP TABLE users; --",
-                    "email": "hacker@evil.com",
-                    "name": "Bobby Tables",
-                },
-            )
+        # Should handle gracefully
+        assert response.status_code == 200
+        data = response.json()
+        assert data["success"] is True
+
+    @pytest.mark.parametrize(
+        "xss_prompt",
+        [
+            "<script>alert('XSS')</script>Create a cube",
+            "<img src=x onerror=alert('XSS')>Create a cube",
+        ],
+    )
+    def test_xss_in_prompt(self, client, mock_generation_stack, xss_prompt):
+        """Test XSS attempts in prompt field"""
+        response = client.post("/api/generate", json={"prompt": xss_prompt})
 
-            # Should handle gracefully
-            assert response.status_code == 200
-            data = response.json()
-            assert data["success"] is True
+        assert response.status_code == 200
+        # XSS should be passed to AI but not executed
+        mock_generation_stack.ai_generator.generate_badcad_code.assert_called_with(
+            xss_prompt
+        )
 
-    def test_xss_in_prompt(self):
-        """Test XSS attempts in prompt field"""
-        xss_prompt = "<script>alert('XSS')</script>Create a cube"
-
-        with (
-            patch("api.routes.generation.ai_generator") as mock_ai,
-            patch("api.routes.generation.badcad_executor") as mock_exec,
-            patch("api.routes.generation.model_storage"),
-        ):
-            mock_ai.generate_badcad_code.return_value = (
-                "from badcad import *\nmodel = cube(10,10,10)"
-            )
-            mock_exec.execute_and_export.return_value = "/tmp/safe.stl"
+    @pytest.mark.parametrize(
+        "error",
+        [TimeoutError("execution timed out"), MemoryError()],
+        ids=["timeout", "memory_error"],
+    )
+    def test_executor_exception_returns_generic_500(
+        self, client, mock_generation_stack, stub_code, error
+    ):
+        """Test that an executor failure surfaces as a generic server error"""
+        mock_generation_stack.badcad_executor.execute_and_export.side_effect = error
 
-            response = client.post("/api/generate", json={"prompt": xss_prompt})
+        response = client.post("/api/execute", json={"code": stub_code})
 
-            assert response.status_code == 200
-            # XSS should be passed to AI but not executed
-            mock_ai.generate_badcad_code.assert_called_with(xss_prompt)
+        assert response.status_code == 500
+        assert response.json()["detail"] == "Failed to execute BadCAD code"
+        mock_generation_stack.model_storage.store_model.assert_not_called()
 
-    def test_admin_endpoint_no_auth(self):
+    def test_admin_endpoint_no_auth(self, client, admin_summary):
         """Test that admin endpoint is accessible without auth"""
-        with patch("api.routes.admin.user_manager") as mock_um:
-            mock_um.get_all_users_summary.return_value = {
-                "total_users": 0,
-                "total_prompts": 0,
-                "total_models_generated": 0,
-                "users": [],
-            }
-
-            response = client.get("/api/admin/collected-emails")
+        response = client.get("/api/admin/collected-emails")
 
-            # Currently returns 200 - this documents the security issue
-            assert response.status_code == 200
+        # Currently returns 200 - this documents the security issue
+        assert response.status_code == 200
 
-    def test_cors_all_origins(self):
+    def test_cors_all_origins(self, client):
         """Test CORS configuration allows all origins"""
         response = client.options(
             "/api/generate",
@@ -106,97 +131,88 @@ class TestSecurityConcerns:
 class TestEdgeCases:
     """Test edge cases and boundary conditions"""
 
-    def test_empty_prompt(self):
+    def test_empty_prompt(self, client):
         """Test empty prompt handling"""
         response = client.post("/api/generate", json={"prompt": ""})
         # Pydantic min_length=1 validation rejects empty string
         assert response.status_code == 422
 
-    def test_whitespace_only_prompt(self):
+    def test_whitespace_only_prompt(self, client):
         """Test whitespace-only prompt handling"""
         response = client.post("/api/generate", json={"prompt": "   "})
         assert response.status_code == 400
         assert "No prompt provided" in response.json()["detail"]
 
-    def test_very_long_prompt(self):
+    def test_very_long_prompt(self, client):
         """Test handling of very long prompts"""
         long_prompt = "Create a cube " * 1000
 
-        with (
-            patch("api.routes.generation.ai_generator") as mock_ai,
-            patch("api.routes.generation.badcad_executor") as mock_exec,
-            patch("api.routes.generation.model_storage"),
-        ):
-            mock_ai.generate_badcad_code.return_value = (
-                "from badcad import *\nmodel = cube(10,10,10)"
-            )
-            mock_exec.execute_and_export.return_value = "/tmp/test.stl"
-
-            response = client.post("/api/generate", json={"prompt": long_prompt})
+        response = client.post("/api/generate", json={"prompt": long_prompt})
 
-            assert response.status_code == 200
+        assert response.status_code == 200
 
-    def test_unicode_in_prompt(self):
+    def test_unicode_in_prompt(self, client):
         """Test Unicode characters in prompt"""
         unicode_prompt = "创建一个立方体 with émojis and ñ characters"
 
-        with (
-            patch("api.routes.generation.ai_generator") as mock_ai,
-            patch("api.routes.generation.badcad_executor") as mock_exec,
-            patch("api.routes.generation.model_storage"),
-        ):
-            mock_ai.generate_badcad_code.return_value = (
-                "from badcad import *\nmodel = cube(10,10,10)"
-            )
-            mock_exec.execute_and_export.return_value = "/tmp/test.stl"
-
-            response = client.post("/api/generate", json={"prompt": unicode_prompt})
+        response = client.post("/api/generate", json={"prompt": unicode_prompt})
 
-            assert response.status_code == 200
+        assert response.status_code == 200
 
-    def test_special_characters_in_email(self):
+    @pytest.mark.parametrize(
+        "email", ["user.name@sub.domain.com", "user_123@example-site.com"]
+    )
+    def test_special_characters_in_email(self, client, email):
         """Test special characters in email addresses"""
-        valid_emails = [
-            "user.name@sub.domain.com",
-            "user_123@example-site.com",
-        ]
-
-        for email in valid_emails:
-            with patch("api.routes.user.analytics_client") as mock_analytics:
-                mock_analytics.create_session = AsyncMock(
-                    return_value={
-                        "user": {"model_count": 0},
-                        "session_id": "test",
-                        "csrf_token": "test",
-                    }
-                )
+        response = client.post(
+            "/api/user/info",
+            json={
+                "user_id": f"user_{email.replace('@', '_at_')}",
+                "email": email,
+                "name": "Special User",
+            },
+        )
+
+        assert response.status_code == 200
 
-                response = client.post(
-                    "/api/user/info",
-                    json={
-                        "user_id": f"user_{email.replace('@', '_at_')}",
-                        "email": email,
-                        "name": "Special User",
-                    },
+    async def test_concurrent_requests_same_user(self, async_client, mock_analytics):
+        """Test racing count increments for one user all succeed"""
+        counts = iter(range(1, 6))
+
+        async def increment(user_id, session_cookie):
+            return {"model_count": next(counts)}
+
+        async_client.cookies.set("session_id", "test")
+        mock_analytics.increment_user_count = AsyncMock(side_effect=increment)
+
+        results = await asyncio.gather(
+            *(
+                async_client.post(
+                    "/api/user/increment-count", json={"user_id": "race_user"}
                 )
+                for _ in range(5)
+            )
+        )
 
-                assert response.status_code == 200
+        assert [r.status_code for r in results] == [200] * 5
+        assert sorted(r.json()["model_count"] for r in results) == [1, 2, 3, 4, 5]
+        assert mock_analytics.increment_user_count.await_count == 5
 
 
 class TestDataValidation:
     """Test input validation and sanitization"""
 
-    def test_invalid_json_format(self):
+    def test_invalid_json_format(self, client):
         """Test handling of invalid JSON"""
         response = client.post(
             "/api/generate",
-            content="{'invalid': json syntax}",
+            content=b"{'invalid': json syntax}",
             headers={"Content-Type": "application/json"},
         )
 
         assert response.status_code == 422  # Unprocessable Entity
 
-    def test_missing_required_fields(self):
+    def test_missing_required_fields(self, client):
         """Test missing required fields"""
         # Missing prompt
         response = client.post("/api/generate", json={})
@@ -210,29 +226,19 @@ class TestDataValidation:
         response = client.post("/api/user/increment-count", json={})
         assert response.status_code == 422
 
-    def test_additional_unexpected_fields(self):
+    def test_additional_unexpected_fields(self, client):
         """Test handling of unexpected extra fields"""
-        with (
-            patch("api.routes.generation.ai_generator") as mock_ai,
-            patch("api.routes.generation.badcad_executor") as mock_exec,
-            patch("api.routes.generation.model_storage"),
-        ):
-            mock_ai.generate_badcad_code.return_value = (
-                "from badcad import *\nmodel = cube(10,10,10)"
-            )
-            mock_exec.execute_and_export.return_value = "/tmp/test.stl"
-
-            response = client.post(
-                "/api/generate",
-                json={
-                    "prompt": "Create a cube",
-                    "unexpected_field": "should be ignored",
-                    "another_field": 123,
-                },
-            )
+        response = client.post(
+            "/api/generate",
+            json={
+                "prompt": "Create a cube",
+                "unexpected_field": "should be ignored",
+                "another_field": 123,
+            },
+        )
 
-            # Should work, ignoring extra fields
-            assert response.status_code == 200
+        # Should work, ignoring extra fields
+        assert response.status_code == 200
 
 
 if __name__ == "__main__":
@@ -2,8 +2,9 @@
 Tests for STL fallback utilities
 """
 
-import os
-import tempfile
+import stat
+import struct
+from unittest.mock import patch
 
 import pytest
 
@@ -17,40 +18,51 @@ from utils.stl_fallback import (
 class TestCreateFallbackSTL:
     """Test the create_fallback_stl function"""
 
-    def test_create_stl_file(self):
+    def test_create_stl_file(self, tmp_stl):
         """Test creating a fallback STL file"""
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".stl", delete=False) as f:
-            temp_path = f.name
+        create_fallback_stl(str(tmp_stl))
 
-        try:
-            create_fallback_stl(temp_path)
-
-            # Verify file exists
-            assert os.path.exists(temp_path)
-
-            # Verify file has content
-            assert os.path.getsize(temp_path) > 0
-
-            # Verify STL format
-            with open(temp_path, "r") as f:
-                content = f.read()
-                assert content.startswith("solid cube")
-                assert "facet normal" in content
-                assert "vertex" in content
-                assert content.endswith("endsolid cube")
-        finally:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-
-    def test_create_stl_with_directory_creation(self):
+        # Verify file exists
+        assert tmp_stl.exists()
+
+        # Verify file has content
+        assert tmp_stl.stat().st_size > 0
+
+        # Verify binary STL layout: header, triangle count, 50 bytes per facet
+        content = tmp_stl.read_bytes()
+        assert not content.startswith(b"solid")
+        (triangle_count,) = struct.unpack_from("<I", content, 80)
+        assert triangle_count == 12
+        assert len(content) == 84 + 50 * triangle_count
+
+    def test_create_stl_with_directory_creation(self, tmp_path):
         """Test creating STL file with non-existent directory"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            stl_path = os.path.join(temp_dir, "subdir", "test.stl")
+        stl_path = tmp_path / "subdir" / "test.stl"
+
+        create_fallback_stl(str(stl_path))
+
+        assert stl_path.exists()
+        assert stl_path.stat().st_size > 0
+
+    def test_file_mode_matches_plain_open(self, tmp_path, tmp_stl):
+        """Test that the fallback file gets the same mode as an open()-created file"""
+        reference = tmp_path / "reference.stl"
+        with open(reference, "wb") as f:
+            f.write(b"")
+
+        create_fallback_stl(str(tmp_stl))
+
+        assert stat.S_IMODE(tmp_stl.stat().st_mode) == stat.S_IMODE(
+            reference.stat().st_mode
+        )
 
-            create_fallback_stl(stl_path)
+    def test_failed_write_leaves_no_temp_file(self, tmp_path, tmp_stl):
+        """Test that a failed rename removes the temporary file"""
+        with patch("utils.stl_fallback.os.replace", side_effect=OSError("disk")):
+            with pytest.raises(OSError):
+                create_fallback_stl(str(tmp_stl))
 
-            assert os.path.exists(stl_path)
-            assert os.path.getsize(stl_path) > 0
+        assert list(tmp_path.iterdir()) == []
 
 
 class TestGenerateSmartFallbackBadCADCode:
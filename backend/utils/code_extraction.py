@@ -3,9 +3,60 @@ Utilities for extracting BadCAD code from AI model responses
 """
 
 import re
+from functools import lru_cache
+from types import CodeType
 from typing import Optional
 
+# Leftover markdown fences and blank-line runs stripped by clean_code
+_LEADING_FENCE_RE = re.compile(r"^```\w*\n")
+_TRAILING_FENCE_RE = re.compile(r"\n```$")
+_MULTI_BLANK_RE = re.compile(r"\n{3,}")
+
+# Patterns that indicate Python/BadCAD code
+_CODE_PATTERNS = (
+    "=",  # Assignment
+    "square(",  # BadCAD function
+    "circle(",  # BadCAD function
+    "cube(",  # BadCAD function
+    "cylinder(",  # BadCAD function
+    "sphere(",  # BadCAD function
+    "extrude(",  # BadCAD method
+    "move(",  # BadCAD method
+    "rotate(",  # BadCAD method
+    "model =",  # Common variable name
+    "import",  # Import statement
+    "from",  # From import
+    "def ",  # Function definition
+    "class ",  # Class definition
+    "#",  # Comment
+)
+
+# Any of these in a line marks it as code; matched in one regex pass
+_CODE_PATTERN_RE = re.compile("|".join(re.escape(p) for p in _CODE_PATTERNS))
+
+# Patterns that indicate explanatory text (not code)
+_TEXT_WORDS = frozenset(
+    [
+        "create",
+        "generate",
+        "make",
+        "build",  # Common verbs in instructions
+        "will",
+        "should",
+        "can",
+        "must",  # Modal verbs
+        "the",
+        "this",
+        "that",
+        "these",  # Articles/determiners
+    ]
+)
+
+# Characters that rule out a line being plain explanatory text
+_CODE_CHARS = frozenset("=()[]{}")
 
+
+@lru_cache(maxsize=128)
 def extract_badcad_code(response_text: str) -> str:
     """
     Extract BadCAD code from AI model response.
@@ -25,52 +76,15 @@ def extract_badcad_code(response_text: str) -> str:
         return ""
 
     # Strategy 1: Try to find code blocks first
-    code_block_match = re.search(
-        r"```(?:python)?\s*(.*?)\s*```", response_text, re.DOTALL
-    )
-    if code_block_match:
-        return code_block_match.group(1).strip()
+    code_block = _find_code_block(response_text)
+    if code_block is not None:
+        return code_block
 
     # Strategy 2: Look for lines that look like Python code
     lines = response_text.split("\n")
     code_lines = []
     in_code = False
 
-    # Patterns that indicate Python/BadCAD code
-    code_patterns = [
-        "=",  # Assignment
-        "square(",  # BadCAD function
-        "circle(",  # BadCAD function
-        "cube(",  # BadCAD function
-        "cylinder(",  # BadCAD function
-        "sphere(",  # BadCAD function
-        "extrude(",  # BadCAD method
-        "move(",  # BadCAD method
-        "rotate(",  # BadCAD method
-        "model =",  # Common variable name
-        "import",  # Import statement
-        "from",  # From import
-        "def ",  # Function definition
-        "class ",  # Class definition
-        "#",  # Comment
-    ]
-
-    # Patterns that indicate explanatory text (not code)
-    text_patterns = [
-        "create",
-        "generate",
-        "make",
-        "build",  # Common verbs in instructions
-        "will",
-        "should",
-        "can",
-        "must",  # Modal verbs
-        "the",
-        "this",
-        "that",
-        "these",  # Articles/determiners
-    ]
-
     for line in lines:
         stripped = line.strip()
 
@@ -81,16 +95,14 @@ def extract_badcad_code(response_text: str) -> str:
             continue
 
         # Check if line looks like code
-        has_code_pattern = any(pattern in stripped for pattern in code_patterns)
+        has_code_pattern = _CODE_PATTERN_RE.search(stripped) is not None
 
         # Check if line looks like explanatory text
         words = stripped.lower().split()
         has_text_pattern = (
             len(words) > 5  # Long lines are more likely to be text
-            and any(word in text_patterns for word in words)
-            and not any(
-                char in stripped for char in ["=", "(", ")", "[", "]", "{", "}"]
-            )
+            and not _TEXT_WORDS.isdisjoint(words)
+            and _CODE_CHARS.isdisjoint(stripped)
             and not stripped.startswith("#")  # Comments are part of code
         )
 
@@ -111,16 +123,53 @@ def extract_badcad_code(response_text: str) -> str:
     return response_text.strip()
 
 
+def _find_code_block(text: str) -> Optional[str]:
+    """
+    Return the body of the first fenced code block, or None if there is none.
+
+    A plain find() scan for the opening and closing fences; linear in the
+    text length even when a fence is never closed.
+    """
+    start = text.find("```")
+    if start < 0:
+        return None
+
+    end = text.find("```", start + 3)
+    if end < 0:
+        return None
+
+    body = text[start + 3 : end]
+    if body.startswith("python"):
+        body = body[6:]
+    return body.strip()
+
+
+# Code longer than this is validated and compiled without caching, so
+# distinct large payloads cannot pin memory in the caches below
+_CACHE_MAX_CODE_LEN = 16 * 1024
+
+
 def validate_badcad_code(code: str) -> tuple[bool, Optional[str]]:
     """
     Validate that the code appears to be valid BadCAD code.
 
+    Results for code up to _CACHE_MAX_CODE_LEN characters are memoized, so
+    retries of the same code (including code that fails to parse, which the
+    compile cache cannot hold) skip the checks.
+
     Args:
         code: The code to validate
 
     Returns:
         Tuple of (is_valid, error_message)
     """
+    if code and len(code) > _CACHE_MAX_CODE_LEN:
+        return _validate_badcad_code(code)
+    return _validate_badcad_code_cached(code)
+
+
+def _validate_badcad_code(code: str) -> tuple[bool, Optional[str]]:
+    """Run the validation checks; see validate_badcad_code"""
     if not code or not code.strip():
         return False, "Code is empty"
 
@@ -134,13 +183,46 @@ def validate_badcad_code(code: str) -> tuple[bool, Optional[str]]:
 
     # Basic syntax check - ensure it's parseable Python
     try:
-        compile(code, "<string>", "exec")
+        compile_badcad_code(code)
     except SyntaxError as e:
         return False, f"Syntax error: {str(e)}"
 
     return True, None
 
 
+_validate_badcad_code_cached = lru_cache(maxsize=512)(_validate_badcad_code)
+
+
+def compile_badcad_code(code: str) -> CodeType:
+    """
+    Compile BadCAD code for exec, reusing the code object for repeated code.
+
+    Fallback templates recur constantly, and validation and execution of the
+    same code share a single parse. Code over _CACHE_MAX_CODE_LEN characters
+    is compiled fresh each time.
+
+    Args:
+        code: The code to compile
+
+    Returns:
+        Compiled code object
+
+    Raises:
+        SyntaxError: If the code is not valid Python
+    """
+    if len(code) > _CACHE_MAX_CODE_LEN:
+        return _compile(code)
+    return _compile_cached(code)
+
+
+def _compile(code: str) -> CodeType:
+    """Compile code the same way exec() of a source string would"""
+    return compile(code, "<string>", "exec")
+
+
+_compile_cached = lru_cache(maxsize=128)(_compile)
+
+
 def clean_code(code: str) -> str:
     """
     Clean up code by removing common issues.
@@ -154,18 +236,20 @@ def clean_code(code: str) -> str:
     if not code:
         return ""
 
+    # Each pass is skipped by a C-level substring check when it has nothing
+    # to do, so already-clean code is scanned rather than copied repeatedly
+
     # Remove any markdown formatting that might have been missed
-    code = re.sub(r"^```\w*\n", "", code)
-    code = re.sub(r"\n```$", "", code)
+    if "```" in code:
+        code = _LEADING_FENCE_RE.sub("", code)
+        code = _TRAILING_FENCE_RE.sub("", code)
 
     # Ensure consistent line endings
-    code = code.replace("\r\n", "\n").replace("\r", "\n")
+    if "\r" in code:
+        code = code.replace("\r\n", "\n").replace("\r", "\n")
 
     # Remove excessive blank lines (more than 2 in a row)
-    code = re.sub(r"\n\n\n+", "\n\n", code)
-
-    # Ensure the code ends with a newline
-    if code and not code.endswith("\n"):
-        code += "\n"
+    if "\n\n\n" in code:
+        code = _MULTI_BLANK_RE.sub("\n\n", code)
 
     return code.strip()
@@ -3,108 +3,74 @@ STL fallback generation utilities
 """
 
 import os
-from typing import Dict, Callable
+import struct
+import tempfile
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple
+
+# Fallback unit cube as (normal, vertex1, vertex2, vertex3) facets
+_CUBE_FACETS = (
+    ((0.0, 0.0, 1.0), (1.0, 1.0, 1.0), (-1.0, 1.0, 1.0), (-1.0, -1.0, 1.0)),
+    ((0.0, 0.0, 1.0), (1.0, 1.0, 1.0), (-1.0, -1.0, 1.0), (1.0, -1.0, 1.0)),
+    ((0.0, 0.0, -1.0), (1.0, -1.0, -1.0), (-1.0, -1.0, -1.0), (-1.0, 1.0, -1.0)),
+    ((0.0, 0.0, -1.0), (1.0, -1.0, -1.0), (-1.0, 1.0, -1.0), (1.0, 1.0, -1.0)),
+    ((0.0, 1.0, 0.0), (1.0, 1.0, 1.0), (1.0, 1.0, -1.0), (-1.0, 1.0, -1.0)),
+    ((0.0, 1.0, 0.0), (1.0, 1.0, 1.0), (-1.0, 1.0, -1.0), (-1.0, 1.0, 1.0)),
+    ((0.0, -1.0, 0.0), (1.0, -1.0, 1.0), (-1.0, -1.0, 1.0), (-1.0, -1.0, -1.0)),
+    ((0.0, -1.0, 0.0), (1.0, -1.0, 1.0), (-1.0, -1.0, -1.0), (1.0, -1.0, -1.0)),
+    ((1.0, 0.0, 0.0), (1.0, 1.0, 1.0), (1.0, -1.0, 1.0), (1.0, -1.0, -1.0)),
+    ((1.0, 0.0, 0.0), (1.0, 1.0, 1.0), (1.0, -1.0, -1.0), (1.0, 1.0, -1.0)),
+    ((-1.0, 0.0, 0.0), (-1.0, 1.0, 1.0), (-1.0, 1.0, -1.0), (-1.0, -1.0, -1.0)),
+    ((-1.0, 0.0, 0.0), (-1.0, 1.0, 1.0), (-1.0, -1.0, -1.0), (-1.0, -1.0, 1.0)),
+)
+
+# Binary STL: 80-byte header (must not start with "solid", or readers take it
+# for ASCII), little-endian triangle count, then 50 bytes per facet
+_FALLBACK_STL_BYTES = b"".join(
+    [
+        b"text-to-cad fallback cube".ljust(80, b"\0"),
+        struct.pack("<I", len(_CUBE_FACETS)),
+        *(
+            struct.pack("<12fH", *normal, *v1, *v2, *v3, 0)
+            for normal, v1, v2, v3 in _CUBE_FACETS
+        ),
+    ]
+)
+
+# Process umask, read once at import (os.umask can only be read by setting
+# it); the temp file is given the mode a plain open() would have created
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
 
 def create_fallback_stl(stl_path: str) -> None:
     """
-    Create a simple fallback STL file (cube).
+    Create a simple fallback STL file (binary, cube).
 
     Args:
         stl_path: Path where the STL file should be created
     """
-    stl_content = """solid cube
-  facet normal 0.0 0.0 1.0
-    outer loop
-      vertex 1.0 1.0 1.0
-      vertex -1.0 1.0 1.0
-      vertex -1.0 -1.0 1.0
-    endloop
-  endfacet
-  facet normal 0.0 0.0 1.0
-    outer loop
-      vertex 1.0 1.0 1.0
-      vertex -1.0 -1.0 1.0
-      vertex 1.0 -1.0 1.0
-    endloop
-  endfacet
-  facet normal 0.0 0.0 -1.0
-    outer loop
-      vertex 1.0 -1.0 -1.0
-      vertex -1.0 -1.0 -1.0
-      vertex -1.0 1.0 -1.0
-    endloop
-  endfacet
-  facet normal 0.0 0.0 -1.0
-    outer loop
-      vertex 1.0 -1.0 -1.0
-      vertex -1.0 1.0 -1.0
-      vertex 1.0 1.0 -1.0
-    endloop
-  endfacet
-  facet normal 0.0 1.0 0.0
-    outer loop
-      vertex 1.0 1.0 1.0
-      vertex 1.0 1.0 -1.0
-      vertex -1.0 1.0 -1.0
-    endloop
-  endfacet
-  facet normal 0.0 1.0 0.0
-    outer loop
-      vertex 1.0 1.0 1.0
-      vertex -1.0 1.0 -1.0
-      vertex -1.0 1.0 1.0
-    endloop
-  endfacet
-  facet normal 0.0 -1.0 0.0
-    outer loop
-      vertex 1.0 -1.0 1.0
-      vertex -1.0 -1.0 1.0
-      vertex -1.0 -1.0 -1.0
-    endloop
-  endfacet
-  facet normal 0.0 -1.0 0.0
-    outer loop
-      vertex 1.0 -1.0 1.0
-      vertex -1.0 -1.0 -1.0
-      vertex 1.0 -1.0 -1.0
-    endloop
-  endfacet
-  facet normal 1.0 0.0 0.0
-    outer loop
-      vertex 1.0 1.0 1.0
-      vertex 1.0 -1.0 1.0
-      vertex 1.0 -1.0 -1.0
-    endloop
-  endfacet
-  facet normal 1.0 0.0 0.0
-    outer loop
-      vertex 1.0 1.0 1.0
-      vertex 1.0 -1.0 -1.0
-      vertex 1.0 1.0 -1.0
-    endloop
-  endfacet
-  facet normal -1.0 0.0 0.0
-    outer loop
-      vertex -1.0 1.0 1.0
-      vertex -1.0 1.0 -1.0
-      vertex -1.0 -1.0 -1.0
-    endloop
-  endfacet
-  facet normal -1.0 0.0 0.0
-    outer loop
-      vertex -1.0 1.0 1.0
-      vertex -1.0 -1.0 -1.0
-      vertex -1.0 -1.0 1.0
-    endloop
-  endfacet
-endsolid cube"""
-
-    # Ensure directory exists
-    os.makedirs(os.path.dirname(stl_path), exist_ok=True)
-
-    with open(stl_path, "w") as f:
-        f.write(stl_content)
+    # Ensure directory exists (usually it already does)
+    directory = os.path.dirname(stl_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    # Write a uniquely named file beside the target and rename it, so readers
+    # never see a partial file and concurrent writers don't share a temp file
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory or os.curdir, prefix=".fallback-", suffix=".tmp"
+    )
+    try:
+        os.fchmod(fd, 0o666 & ~_UMASK)
+        with os.fdopen(fd, "wb") as f:
+            f.write(_FALLBACK_STL_BYTES)
+        os.replace(tmp_path, stl_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
 
 
 def generate_smart_fallback_badcad_code(prompt: str) -> str:
@@ -117,56 +83,37 @@ def generate_smart_fallback_badcad_code(prompt: str) -> str:
     Returns:
         BadCAD code that somewhat matches the prompt
     """
-    prompt_lower = prompt.lower()
-
-    # Define keyword-based generators
-    generators: Dict[tuple, Callable[[], str]] = {
-        ("cone", "triangle", "pyramid"): _generate_cone_code,
-        ("sphere", "ball", "round", "orb"): _generate_sphere_code,
-        ("cylinder", "tube", "pipe", "rod"): _generate_cylinder_code,
-        ("ring", "washer", "hole", "donut", "torus"): _generate_ring_code,
-        ("gear", "cog", "teeth", "sprocket"): _generate_gear_code,
-        ("star", "asterisk"): _generate_star_code,
-        ("hexagon", "hex", "nut", "bolt"): _generate_hexagon_code,
-        ("stairs", "staircase", "steps"): _generate_stairs_code,
-        ("cross", "plus", "+"): _generate_cross_code,
-    }
-
-    # Check each set of keywords
-    for keywords, generator in generators.items():
-        if any(word in prompt_lower for word in keywords):
-            return generator()
+    return _fallback_code_cached(prompt.lower())
 
-    # Default to a simple box
-    return _generate_default_box_code()
+
+@lru_cache(maxsize=512)
+def _fallback_code_cached(normalized_prompt: str) -> str:
+    """Pick the fallback code for a lowercased prompt; repeated prompts hit the cache"""
+    return _dispatch(normalized_prompt)
 
 
-def _generate_cone_code() -> str:
-    """Generate cone BadCAD code"""
-    return """from badcad import *
+# Cone fallback
+_CONE_CODE = """from badcad import *
 # Simple cone (AI service temporarily unavailable)
 base = circle(r=10)
 tip = circle(r=0.5)
 model = base.extrude_to(tip, 15)"""
 
 
-def _generate_sphere_code() -> str:
-    """Generate sphere BadCAD code"""
-    return """from badcad import *
+# Sphere fallback
+_SPHERE_CODE = """from badcad import *
 # Simple sphere (AI service temporarily unavailable)
 model = sphere(r=8)"""
 
 
-def _generate_cylinder_code() -> str:
-    """Generate cylinder BadCAD code"""
-    return """from badcad import *
+# Cylinder fallback
+_CYLINDER_CODE = """from badcad import *
 # Simple cylinder (AI service temporarily unavailable)
 model = cylinder(h=20, r=6)"""
 
 
-def _generate_ring_code() -> str:
-    """Generate ring BadCAD code"""
-    return """from badcad import *
+# Ring fallback
+_RING_CODE = """from badcad import *
 # Simple ring (AI service temporarily unavailable)
 outer = circle(r=10)
 inner = circle(r=5)
@@ -174,11 +121,12 @@ ring = outer - inner
 model = ring.extrude(5)"""
 
 
-def _generate_gear_code() -> str:
-    """Generate gear BadCAD code"""
-    return """from badcad import *
-# Simple gear (AI service temporarily unavailable)
-import math
+# Preamble for the snippets that need trigonometry
+_MATH_HEADER = "from badcad import *\nimport math\n"
+
+
+# Gear fallback
+_GEAR_CODE = _MATH_HEADER + """# Simple gear (AI service temporarily unavailable)
 outer = circle(r=12)
 inner = circle(r=8)
 gear_base = outer - inner
@@ -191,11 +139,8 @@ for i in range(12):
 model = gear_base.extrude(5)"""
 
 
-def _generate_star_code() -> str:
-    """Generate star BadCAD code"""
-    return """from badcad import *
-# Simple star (AI service temporarily unavailable)
-import math
+# Star fallback
+_STAR_CODE = _MATH_HEADER + """# Simple star (AI service temporarily unavailable)
 points = []
 for i in range(10):
     angle = i * math.pi / 5
@@ -205,17 +150,15 @@ star = polygon(points)
 model = star.extrude(3)"""
 
 
-def _generate_hexagon_code() -> str:
-    """Generate hexagon BadCAD code"""
-    return """from badcad import *
+# Hexagon fallback
+_HEXAGON_CODE = """from badcad import *
 # Simple hexagon (AI service temporarily unavailable)
 hex_shape = circle(r=10, fn=6)
 model = hex_shape.extrude(5)"""
 
 
-def _generate_stairs_code() -> str:
-    """Generate stairs BadCAD code"""
-    return """from badcad import *
+# Stairs fallback
+_STAIRS_CODE = """from badcad import *
 # Simple staircase (AI service temporarily unavailable)
 step_width = 30
 step_depth = 20
@@ -229,9 +172,8 @@ step3 = cube(step_width, step_depth, step_height, center=True).move(0, step_dept
 model = step1 + step2 + step3"""
 
 
-def _generate_cross_code() -> str:
-    """Generate cross BadCAD code"""
-    return """from badcad import *
+# Cross fallback
+_CROSS_CODE = """from badcad import *
 # Simple cross (AI service temporarily unavailable)
 horizontal = square(30, 10, center=True)
 vertical = square(10, 30, center=True)
@@ -239,15 +181,59 @@ cross = horizontal + vertical
 model = cross.extrude(5)"""
 
 
-def _generate_default_box_code() -> str:
-    """Generate default box BadCAD code"""
-    return """from badcad import *
+# Default box fallback
+_DEFAULT_BOX_CODE = """from badcad import *
 # Simple box (AI service temporarily unavailable)
 # Generated fallback based on your prompt
 box = square(15, 15, center=True)
 model = box.extrude(8)"""
 
 
+# Keyword groups in priority order, each mapped to its template
+_KEYWORD_CATEGORIES: List[Tuple[Tuple[str, ...], str]] = [
+    (("cone", "triangle", "pyramid"), _CONE_CODE),
+    (("sphere", "ball", "round", "orb"), _SPHERE_CODE),
+    (("cylinder", "tube", "pipe", "rod"), _CYLINDER_CODE),
+    (("ring", "washer", "hole", "donut", "torus"), _RING_CODE),
+    (("gear", "cog", "teeth", "sprocket"), _GEAR_CODE),
+    (("star", "asterisk"), _STAR_CODE),
+    (("hexagon", "hex", "nut", "bolt"), _HEXAGON_CODE),
+    (("stairs", "staircase", "steps"), _STAIRS_CODE),
+    (("cross", "plus", "+"), _CROSS_CODE),
+]
+
+
+def _build_dispatch() -> Callable[[str], str]:
+    """
+    Generate the keyword matcher as straight-line source and compile it.
+
+    Each category becomes one `if 'kw' in p or ...: return` branch, in
+    priority order, so a lookup is a run of C-level substring tests with no
+    loop or generator overhead.
+    """
+    lines = ["def _dispatch(p):"]
+    namespace: Dict[str, str] = {"_DEFAULT": _DEFAULT_BOX_CODE}
+    for index, (keywords, code) in enumerate(_KEYWORD_CATEGORIES):
+        namespace[f"_CODE_{index}"] = code
+        test = " or ".join(f"{word!r} in p" for word in keywords)
+        lines.append(f"    if {test}:\n        return _CODE_{index}")
+    # Default to a simple box
+    lines.append("    return _DEFAULT")
+
+    exec(compile("\n".join(lines), "<fallback-dispatch>", "exec"), namespace)
+    return namespace["_dispatch"]
+
+
+_dispatch = _build_dispatch()
+
+
+# Absolute fallback code
+_HARDCODED_CODE = """from badcad import *
+# Simple box
+box = square(20, 20, center=True)
+model = box.extrude(10)"""
+
+
 def generate_hardcoded_badcad_code() -> str:
     """
     Generate basic hardcoded BadCAD code.
@@ -256,7 +242,4 @@ def generate_hardcoded_badcad_code() -> str:
     Returns:
         Basic BadCAD code for a simple box
     """
-    return """from badcad import *
-# Simple box
-box = square(20, 20, center=True)
-model = box.extrude(10)"""
+    return _HARDCODED_CODE